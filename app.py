@@ -1,7 +1,17 @@
 import streamlit as st
 import requests
+import asyncio
+import threading
+import sys
+import types
+import hashlib
+import itertools
+import httpx
+from cachetools import TTLCache
 from datetime import datetime
-import json
+import ijson
+import orjson
+import numpy as np
 import pandas as pd
 import altair as alt
 import time
@@ -9,6 +19,9 @@ import os
 from dotenv import load_dotenv
 from streamlit_autorefresh import st_autorefresh
 from pyproj import Transformer
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
 # Load environment variables from .env file
 load_dotenv()
 
@@ -16,43 +29,153 @@ load_dotenv()
 # 1. Setting the API key and API call function
 #---------------------------------------------------------------------------------------------------
 
-@st.cache_data(ttl=300)# Cache for 5 minutes instead of 30 seconds
-def fetch_latest_earthquakes():
+@st.cache_resource
+def get_http_session():
     """
-    Fetch latest earthquake data from GeoNet API.
-    Data is cached for 5 minutes to reduce API load.
+    Returns one pooled requests session per process.
+    It is cached as a resource because app.py reruns top to bottom, and a module-level session would be
+    rebuilt on every rerun, dropping its kept-alive TCP/TLS connections.
+    """
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip"})
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=3, backoff_factor=0.3))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Maps the flattened GeoNet GeoJSON columns produced by pd.json_normalize to the display column names.
+GEONET_COLUMNS = {
+    "properties.publicID": "ID",
+    "properties.locality": "Location",
+    "properties.magnitude": "Magnitude",
+    "properties.depth": "Depth (km)",
+    "properties.mmi": "Shaking Intensity (MMI)",
+}
+
+GEONET_FRESHNESS_SECONDS = 30
+
+def build_quake_dataframe(features):
+    """
+    Flattens GeoNet GeoJSON features into the display DataFrame in one vectorized pass.
+    """
+    df = pd.json_normalize(features, max_level=2).rename(columns=GEONET_COLUMNS)
+    # Dropping the zone after conversion keeps NZ wall-clock time and lets dt.strftime use pandas' C fast path
+    # for this format; tz-aware values are formatted one Python datetime at a time.
+    df["Time (NZST)"] = (pd.to_datetime(df["properties.time"], utc=True, format="ISO8601")
+                         .dt.tz_convert("Pacific/Auckland")
+                         .dt.tz_localize(None)
+                         .dt.strftime('%Y-%m-%d %H:%M:%S'))
+    df["latitude"] = df["geometry.coordinates"].str[1]
+    df["longitude"] = df["geometry.coordinates"].str[0]
+    return df.reindex(columns=[*GEONET_COLUMNS.values(), "Time (NZST)", "latitude", "longitude"])
+
+@st.cache_resource
+def get_geonet_cache():
+    """
+    Returns the process-wide GeoNet response cache: the last parsed DataFrame, its HTTP validators and fetch time.
+    """
+    return {"quakes": None, "etag": None, "last_modified": None, "fetched_at": 0.0, "lock": threading.Lock()}
+
+def fetch_quakes_cached():
+    """
+    Fetch latest earthquake data from GeoNet API as a DataFrame.
+    This single cached fetch feeds the background major-quake check, the on-screen alert and the display.
+    Data younger than 30 seconds is reused without a request. Older data is revalidated with a
+    conditional GET, and a 304 Not Modified reply reuses it without downloading or parsing the body again.
+    It is also called from the background event loop, so request errors are raised to the caller instead of shown with st.*.
     """
     api_url = "https://api.geonet.org.nz/quake?MMI=3"
-    
-    try:
-        response = requests.get(api_url)
-        response.raise_for_status()
-        data = response.json()
+    cache = get_geonet_cache()
+
+    # Holding the lock across the request means concurrent sessions share one fetch instead of racing.
+    with cache["lock"]:
+        if cache["quakes"] is not None and time.monotonic() - cache["fetched_at"] < GEONET_FRESHNESS_SECONDS:
+            return cache["quakes"]
+
+        headers = {}
+        if cache["etag"]:
+            headers["If-None-Match"] = cache["etag"]
+        if cache["last_modified"]:
+            headers["If-Modified-Since"] = cache["last_modified"]
         
-        earthquakes = []
-        for feature in data['features'][:5]:
-            props = feature['properties']
-            time_utc = datetime.fromisoformat(props['time'].replace('Z', '+00:00'))
-            
-            earthquakes.append({
-                "ID": props['publicID'],
-                "Location": props['locality'],
-                "Magnitude": props['magnitude'],
-                "Depth (km)": props['depth'],
-                "Shaking Intensity (MMI)": props['mmi'],
-                "Time (NZST)": time_utc.strftime('%Y-%m-%d %H:%M:%S'),
-                "latitude": feature['geometry']['coordinates'][1],
-                "longitude": feature['geometry']['coordinates'][0]
-            })
-        return earthquakes
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error accessing GeoNet API: {e}")
-        return None
+        with get_http_session().get(api_url, headers=headers, stream=True, timeout=(3, 10)) as response:
+            response.raise_for_status()
+
+            if response.status_code != 304:
+                # Stream-parse only the first five features instead of parsing the whole feed.
+                response.raw.decode_content = True # Let urllib3 undo the gzip encoding while streaming
+                try:
+                    features = list(itertools.islice(ijson.items(response.raw, 'features.item', use_float=True), 5))
+                # requests does not wrap errors raised while reading response.raw, so keep callers on requests exceptions.
+                except ijson.JSONError as e:
+                    raise requests.exceptions.InvalidJSONError(f"Invalid JSON in GeoNet response: {e}") from e
+                except urllib3.exceptions.HTTPError as e:
+                    raise requests.exceptions.ConnectionError(e) from e
+                cache["quakes"] = build_quake_dataframe(features) if features else None
+                cache["etag"] = response.headers.get("ETag")
+                cache["last_modified"] = response.headers.get("Last-Modified")
+            # Discard the unparsed tail so the connection goes back to the pool instead of being closed.
+            response.raw.drain_conn()
+        cache["fetched_at"] = time.monotonic()
+        return cache["quakes"]
+
+@st.cache_resource
+def load_prompt_template():
+    """
+    Reads the LLM prompt template once per process instead of on every rerun.
+    """
+    with open("llm_prompt.txt", "r", encoding="utf-8") as f:
+        return f.read()
+
+def format_prompt_value(value, format_spec=""):
+    """
+    Formats one field for the prompt, writing "n/a" when GeoNet left it out (None or NaN).
+    """
+    return format(value, format_spec) if pd.notna(value) else "n/a"
 
-def call_llm_api(prompt):
+def format_quakes_for_prompt(quakes):
+    """
+    Renders earthquakes as one compact line each, e.g. "M4.6 10 km west of Taumarunui d5km mmi4 @ 2025-11-10 18:51:34".
+    This needs far fewer input tokens than JSON with repeated keys, which shortens the LLM's prompt processing.
+    """
+    return "\n".join(
+        f"M{format_prompt_value(q['Magnitude'], '.1f')} {format_prompt_value(q['Location'])} "
+        f"d{format_prompt_value(q['Depth (km)'], '.0f')}km "
+        f"mmi{format_prompt_value(q['Shaking Intensity (MMI)'], '.0f')} @ {format_prompt_value(q['Time (NZST)'])}"
+        for q in quakes
+    )
+
+def format_population_for_prompt(population_data):
+    """
+    Renders population data as one "location: name=value, ..." line per earthquake, leaving out geometry.
+    """
+    if not population_data:
+        return "No population data available."
+    lines = []
+    for entry in population_data:
+        features = entry['Population'] or []
+        pairs = ", ".join(f"{feature['Name']}={feature['Value']}" for feature in features)
+        lines.append(f"{entry['Location']}: {pairs or 'no data'}")
+    return "\n".join(lines)
+
+@st.cache_resource
+def get_ollama_client():
+    """
+    Returns a dedicated keep-alive httpx client for Ollama, so long report streams never hold
+    connections that the GeoNet and Stats NZ requests need.
+    """
+    return httpx.Client(
+        # HTTP/2 is used wherever the server offers it; a plain-http Ollama server keeps to HTTP/1.1 keep-alive.
+        transport=httpx.HTTPTransport(http2=True, retries=3),
+        # Generation can take a while on CPU, so allow a longer read timeout than the data APIs.
+        timeout=httpx.Timeout(connect=3, read=120, write=10, pool=3),
+    )
+
+def call_llm_api(prompt, on_token=None):
     """
     Calls a local Ollama model to generate a response in a structured JSON format.
     Assumes Ollama is running at http://localhost:11434.
+    The response is streamed; if on_token is given, it is called with the text generated so far after each chunk.
     """
     url = "http://127.0.0.1:11434/api/generate"
     headers = {
@@ -60,8 +183,9 @@ def call_llm_api(prompt):
     }
     
     # Define the model to use. Make sure you have this model pulled in Ollama.
-    # You can change "llama3" to any other model you have available.
-    model_name = "llama3"
+    # The 4-bit quantized Llama 3 generates several times faster on CPU than the default llama3 tag.
+    # Set OLLAMA_MODEL_NAME to use any other model you have available.
+    model_name = os.getenv("OLLAMA_MODEL_NAME", "llama3:8b-instruct-q4_K_M")
 
     # The prompt already asks for a JSON output, which is good.
     # Ollama's `generate` endpoint expects a `prompt` field.
@@ -70,43 +194,133 @@ def call_llm_api(prompt):
         "model": model_name,
         "prompt": prompt,
         "format": "json", # Request JSON output from Ollama
-        "stream": False
+        "stream": True, # Stream tokens so the UI can show the report while it is being generated
+        # Cap the report length and context window; a five-quake report fits comfortably in both.
+        "options": {"num_predict": 512, "num_ctx": 2048}
     }
 
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        
-        # Ollama (with format: "json") returns a JSON object where the 'response' field contains the JSON string.
-        ollama_response = response.json()
-        json_string = ollama_response.get('response')
+        with get_ollama_client().stream("POST", url, headers=headers, content=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+
+            # Ollama streams one JSON object per line; each carries the next fragment of the JSON report in 'response'.
+            json_string = ""
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if 'error' in chunk:
+                    return {"error": f"The LLM server returned an error: {chunk['error']}"}
+                json_string += chunk.get('response', '')
+                if on_token:
+                    on_token(json_string)
+                if chunk.get('done'):
+                    break
 
         if json_string:
             try:
-                # The response itself is a JSON string, so we parse it again.
-                llm_data = json.loads(json_string)
+                # The accumulated fragments form a JSON string, so we parse it once the stream is done.
+                llm_data = orjson.loads(json_string)
                 return llm_data
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 return {"error": "Failed to parse the JSON content from the LLM response."}
         else:
             return {"error": "The API returned an empty or malformed response."}
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         st.error(f"Error connecting to Ollama API: {e}. Is Ollama running?")
         return {"error": "Could not connect to the local LLM server."}
+    except orjson.JSONDecodeError as e:
+        st.error(f"Ollama API returned a malformed stream: {e}")
+        return {"error": "The API returned an empty or malformed response."}
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
         return {"error": "An unexpected error occurred while calling the LLM."}
 
-def get_population_data_from_statsnz(longitude, latitude, radius_meters=10000):
+@st.cache_resource
+def get_report_cache():
     """
-    A function that retrieves population-related data around specified coordinates from the Stats NZ Spatial Query API.
+    Returns the process-wide cache of generated LLM reports and the lock guarding it.
+    Entries expire after 10 minutes so revised GeoNet data is eventually re-reported.
     """
-    api_key = os.getenv("STATS_NZ_API_KEY")
-    if not api_key:
-        st.warning("STATS_NZ_API_KEY not found in .env file. Population data will not be fetched.")
-        return None
+    return TTLCache(maxsize=64, ttl=600), threading.Lock()
+
+def generate_report(prompt, quakes, population_data, user_persona, on_token=None):
+    """
+    Returns the LLM report for the prompt, reusing a cached report when the inputs have not meaningfully changed.
+    Auto-refreshes usually see the same earthquakes, so this skips most calls to the local LLM.
+    """
+    prompt_key = (hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest(), user_persona)
+    # GeoNet revises magnitudes slightly between polls, so the same places at the same rounded magnitude share a report.
+    # Which population lookups succeeded is part of the key, so a report written without population data is not reused once it arrives.
+    semantic_key = (
+        tuple((round(q['Magnitude'], 1), q['Location']) for q in quakes if pd.notna(q['Magnitude'])),
+        tuple(entry['Population'] is not None for entry in population_data or []),
+        user_persona,
+    )
+
+    report_cache, lock = get_report_cache()
+    with lock:
+        cached_report = report_cache.get(prompt_key) or report_cache.get(semantic_key)
+    if cached_report is not None:
+        return cached_report
+
+    llm_response = call_llm_api(prompt, on_token=on_token)
+    # Only successful reports are cached, so a temporarily unavailable Ollama server is retried on the next rerun.
+    if 'error' not in llm_response:
+        with lock:
+            report_cache[prompt_key] = llm_response
+            report_cache[semantic_key] = llm_response
+    return llm_response
+
+PROCESS_STATE_MODULE = "geonet_reporter_process_state"
+
+def get_process_state():
+    """
+    Returns a namespace that lives for the whole process, registered in sys.modules.
+    Unlike st.cache_resource it is not emptied by "Clear cache" or st.cache_resource.clear().
+    """
+    state = types.ModuleType(PROCESS_STATE_MODULE)
+    state.lock = threading.Lock()
+    state.event_loop = None
+    state.alert_future = None
+    # setdefault is atomic, so concurrent sessions all get the first registered namespace.
+    return sys.modules.setdefault(PROCESS_STATE_MODULE, state)
 
+def get_event_loop():
+    """
+    Starts one background asyncio event loop per process, shared by all reruns and sessions.
+    HTTP lookups scheduled on it keep running while the script renders the rest of the page.
+    """
+    state = get_process_state()
+    with state.lock:
+        if state.event_loop is None:
+            state.event_loop = asyncio.new_event_loop()
+            threading.Thread(target=state.event_loop.run_forever, name="geonet-event-loop", daemon=True).start()
+        return state.event_loop
+
+@st.cache_resource
+def get_async_client():
+    """
+    Returns the shared httpx.AsyncClient used by coroutines running on the background event loop.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=10),
+        timeout=httpx.Timeout(10, connect=3),
+    )
+
+def run_in_background(coro):
+    """
+    Schedules a coroutine on the background event loop and returns a concurrent.futures.Future for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+async def fetch_population_data_from_statsnz(client, api_key, longitude, latitude, radius_meters=10000):
+    """
+    A coroutine that retrieves population-related data around specified coordinates from the Stats NZ Spatial Query API.
+    It runs on the background event loop, so errors are raised to the caller instead of being shown with st.*.
+    """
     # Layer ID 115044 is assumed to be a population-related boundary layer based on previous search.
     # We need to confirm its exact nature for proper interpretation.
     layer_id = "115044" 
@@ -120,80 +334,237 @@ def get_population_data_from_statsnz(longitude, latitude, radius_meters=10000):
                f"key={api_key}&layer={layer_id}&x={longitude}&y={latitude}&"
                f"max_results=10&radius={radius_meters}&geometry=true&with_field_names=true")
     
-    try:
-        response = requests.get(api_url)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data and 'features' in data:
-            # Extract relevant properties from features
-            # The exact fields will depend on the layer's schema
-            population_info = []
-            for feature in data['features']:
-                props = feature.get('properties', {})
-                # Assuming 'name' and 'population' or similar fields exist
-                # This part needs adjustment once we know the exact schema of layer 115044
-                population_info.append({
-                    "Name": props.get('name', 'N/A'),
-                    "Value": props.get('value', 'N/A'), # Placeholder, actual field name needed
-                    "Geometry": feature.get('geometry')
-                })
-            return population_info
-        else:
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error accessing Stats NZ API: {e}")
+    response = await client.get(api_url)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    
+    if data and 'features' in data:
+        # Extract relevant properties from features
+        # The exact fields will depend on the layer's schema
+        population_info = []
+        for feature in data['features']:
+            props = feature.get('properties', {})
+            # Assuming 'name' and 'population' or similar fields exist
+            # This part needs adjustment once we know the exact schema of layer 115044
+            population_info.append({
+                "Name": props.get('name', 'N/A'),
+                "Value": props.get('value', 'N/A'), # Placeholder, actual field name needed
+                "Geometry": feature.get('geometry')
+            })
+        return population_info
+    return None
+
+# Upper bound on simultaneous Stats NZ requests, to stay within the API's rate limits.
+STATS_NZ_MAX_CONCURRENCY = 5
+
+async def fetch_population_data_for_quakes(client, api_key, quakes, radius_meters=10000):
+    """
+    Looks up population data around every earthquake concurrently on the shared client.
+    Returns a list aligned with quakes; a failed lookup yields its exception instead of data.
+    """
+    semaphore = asyncio.Semaphore(STATS_NZ_MAX_CONCURRENCY)
+
+    async def fetch_one(quake):
+        async with semaphore:
+            return await fetch_population_data_from_statsnz(
+                client, api_key, quake['longitude'], quake['latitude'], radius_meters
+            )
+
+    return await asyncio.gather(*(fetch_one(quake) for quake in quakes), return_exceptions=True)
+
+def request_population_data(quakes, radius_meters=10000):
+    """
+    Starts the Stats NZ lookups for all earthquakes in the background and returns a pending future.
+    Returns None if no API key is configured.
+    """
+    api_key = os.getenv("STATS_NZ_API_KEY")
+    if not api_key:
         return None
+    return run_in_background(
+        fetch_population_data_for_quakes(get_async_client(), api_key, quakes, radius_meters)
+    )
+
+def get_population_data_from_statsnz(pending, quakes):
+    """
+    Waits for lookups started with request_population_data.
+    Returns one {"Location", "Population"} entry per earthquake, with None for failed or empty lookups.
+    """
+    if pending is None:
+        st.warning("STATS_NZ_API_KEY not found in .env file. Population data will not be fetched.")
+        return None
+
+    try:
+        results = pending.result()
     except Exception as e:
         st.error(f"An unexpected error occurred while fetching population data: {e}")
         return None
 
+    population_data = []
+    for quake, result in zip(quakes, results):
+        # A malformed body is an API failure too, as it was when requests' response.json() raised it.
+        if isinstance(result, (httpx.HTTPError, orjson.JSONDecodeError)):
+            st.error(f"Error accessing Stats NZ API for {quake['Location']}: {result}")
+            result = None
+        elif isinstance(result, Exception):
+            st.error(f"An unexpected error occurred while fetching population data for {quake['Location']}: {result}")
+            result = None
+        population_data.append({"Location": quake['Location'], "Population": result})
+    return population_data
+
 
 #---------------------------------------------------------------------------------------------------
 # 2. Building the Streamlit UI
 #---------------------------------------------------------------------------------------------------
 
-NOTIFICATION_FILE = "notification_status.txt"
+MAGNITUDE_THRESHOLD = 4.0
 
-def read_notification_status():
+def select_major_quakes(earthquake_df, threshold=MAGNITUDE_THRESHOLD):
     """
-    A function to read messages from the notification file.
+    Returns the earthquakes at or above the magnitude threshold.
+    Missing magnitudes are treated as NaN and never match.
     """
-    if os.path.exists(NOTIFICATION_FILE):
-        with open(NOTIFICATION_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-        if content:
-            return content
-    return None
+    return earthquake_df[earthquake_df["Magnitude"].astype("float64") >= threshold]
+
+def build_major_quake_alert(earthquake_df):
+    """
+    Builds the alert message for earthquakes at or above MAGNITUDE_THRESHOLD.
+    Returns None if there are no major earthquakes.
+    """
+    major_quakes = select_major_quakes(earthquake_df)
+    if major_quakes.empty:
+        return None
+    return "\n".join(
+        f"🚨 Major Earthquake Detected! "
+        f"Magnitude: {q['Magnitude']}, "
+        f"Location: {q['Location']}, "
+        f"Time: {q['Time (NZST)']}"
+        for q in major_quakes.to_dict('records')
+    )
+
+ALERT_CHECK_INTERVAL_SECONDS = 30
+
+def send_discord_notification(message):
+    """
+    Sends a notification message to a Discord webhook.
+    """
+    webhook_url = os.getenv("DISCORD_WEBHOOK_URL")
+    if not webhook_url:
+        print("DISCORD_WEBHOOK_URL not found in .env file. Skipping Discord notification.")
+        return
+
+    payload = {
+        "content": message
+    }
+    
+    try:
+        response = get_http_session().post(webhook_url, json=payload, timeout=(3, 10))
+        response.raise_for_status()
+        print("Successfully sent notification to Discord.")
+    except requests.exceptions.RequestException as e:
+        print(f"Error sending notification to Discord: {e}")
+
+def check_for_major_quakes():
+    """
+    A function that checks the shared GeoNet data for major earthquakes and sends them to Discord.
+    It runs on the background event loop, so it logs with print instead of st.*.
+    """
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking for major earthquakes...")
+    try:
+        earthquake_df = fetch_quakes_cached()
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing the GeoNet API in background: {e}")
+        return
+
+    if earthquake_df is None:
+        print("No earthquake data received from GeoNet API.")
+        return
+
+    message = build_major_quake_alert(earthquake_df)
+    if message:
+        send_discord_notification(message)
+    else:
+        print("No major quakes detected.")
+
+async def alert_loop():
+    """
+    Runs check_for_major_quakes every 30 seconds for as long as the app process is alive.
+    """
+    while True:
+        try:
+            # The check uses blocking requests calls, so it runs in a worker thread to keep the loop free for Stats NZ lookups.
+            await asyncio.to_thread(check_for_major_quakes)
+        except Exception as e:
+            print(f"Unexpected error while checking for major earthquakes: {e}")
+        await asyncio.sleep(ALERT_CHECK_INTERVAL_SECONDS)
+
+def start_alert_loop():
+    """
+    Starts the major-quake alert loop on the background event loop, once per process.
+    The guard is kept in the process state rather than st.cache_resource, so clearing the cache does not
+    start a second loop that posts every alert to Discord again.
+    """
+    state = get_process_state()
+    event_loop = get_event_loop()
+    with state.lock:
+        if state.alert_future is None:
+            state.alert_future = asyncio.run_coroutine_threadsafe(alert_loop(), event_loop)
+        return state.alert_future
+
+def bin_magnitudes(earthquake_df, bin_width=0.5):
+    """
+    Pre-bins magnitudes so the chart receives one row per bin instead of one row per earthquake.
+    """
+    magnitudes = earthquake_df["Magnitude"].dropna()
+    low = np.floor(magnitudes.min() / bin_width) * bin_width
+    high = np.floor(magnitudes.max() / bin_width) * bin_width + bin_width
+    bins = np.arange(low, high + bin_width / 2, bin_width)
+    counts = pd.cut(magnitudes, bins, right=False).value_counts(sort=False)
+    return pd.DataFrame({
+        "Magnitude": [f"{interval.left:.1f}–{interval.right:.1f}" for interval in counts.index],
+        "count": counts.to_numpy(),
+    })
+
+# The static sidebar text is a single markdown element, so each rerun sends one element instead of seven.
+SIDEBAR_ABOUT_MARKDOWN = """
+---
+## Project Innovation
+- **Technical Interest**: Combines **Natural Language (LLM)** & **Geospatial Data (GIS)**.
+- **Interactive Demo**: Dynamic map & customizable reports.
+- **Clear Use Cases**: Adaptable for **real estate agents** & **urban planners**.
+
+---
+## Further Improvements (Concept)
+- **Notification Feature**: Background alerts for major quakes.
+- **Historical Data**: Could be expanded to include historical quake analysis.
+"""
 
 # Use the sidebar to organize your UI
 with st.sidebar:
     st.header("App Settings")
     user_persona = st.text_input("Report for:", placeholder="e.g., 'real estate agent' or 'urban planner'")
-    st.markdown("---")
-    st.header("Project Innovation")
-    st.markdown("""
-    - **Technical Interest**: Combines **Natural Language (LLM)** & **Geospatial Data (GIS)**.
-    - **Interactive Demo**: Dynamic map & customizable reports.
-    - **Clear Use Cases**: Adaptable for **real estate agents** & **urban planners**.
-    """)
-    st.markdown("---")
-    st.header("Further Improvements (Concept)")
-    st.markdown("- **Notification Feature**: Background alerts for major quakes.")
-    st.markdown("- **Historical Data**: Could be expanded to include historical quake analysis.")
+    st.markdown(SIDEBAR_ABOUT_MARKDOWN)
 
 st.title("GeoNet Real-time Earthquake Reporter 🌏")
 st.markdown("This app provides a clear report on the latest GeoNet data, which is **automatically refreshed every 5 minutes**.")
 
-# Read and display notifications from the background scheduler
-notification_message = read_notification_status()
+# Background alerts for major quakes (Discord) run inside this process and share the GeoNet cache below.
+start_alert_loop()
+
+# The app runs from top to bottom with each interaction or refresh.
+try:
+    earthquake_df = fetch_quakes_cached()
+except requests.exceptions.RequestException as e:
+    st.error(f"Error accessing GeoNet API: {e}")
+    earthquake_df = None
+# Per-quake code paths (alerts, population lookup, LLM prompt) work on plain records.
+quakes = earthquake_df.to_dict('records') if earthquake_df is not None else None
+
+# Derive major quake alerts from the same data that is displayed below
+notification_message = build_major_quake_alert(earthquake_df) if earthquake_df is not None else None
 if notification_message:
     st.error(notification_message) # Use st.error for major quake alerts
 
-# The app runs from top to bottom with each interaction or refresh.
 st.info(f"Fetching information... (Automatically updates every 5 minutes, last updated: {datetime.now().strftime('%H:%M:%S')})")
-quakes = fetch_latest_earthquakes()
 
 def log_earthquake_data(quakes):
     """
@@ -212,17 +583,20 @@ def log_earthquake_data(quakes):
 
 if quakes:
 
-    if quakes and quakes[0]['Magnitude'] is not None:
+    if quakes and pd.notna(quakes[0]['Magnitude']):
         st.subheader("📍 Recent Earthquakes on the Map")
         
-        earthquake_df = pd.DataFrame(quakes)
+        # Start the Stats NZ lookups for all earthquakes now, so they run while the map, chart and table render.
+        population_request = request_population_data(quakes)
+
         st.map(earthquake_df, latitude='latitude', longitude='longitude', zoom=4)
         
         st.subheader("📊 Earthquake Magnitude Distribution")
-        chart = alt.Chart(earthquake_df).mark_bar().encode(
-            x=alt.X('Magnitude:Q', bin=True),
-            y='count()',
-            tooltip=['Magnitude', 'count()']
+        # The histogram is binned here, so Vega-Lite only draws the bars.
+        chart = alt.Chart(bin_magnitudes(earthquake_df)).mark_bar().encode(
+            x=alt.X('Magnitude:O', sort=None),
+            y='count:Q',
+            tooltip=['Magnitude', 'count']
         ).properties(
             title='Frequency of Earthquakes by Magnitude'
         )
@@ -231,32 +605,39 @@ if quakes:
         st.subheader("📝 Latest Earthquake Data")
         st.write(earthquake_df)
 
-        # Fetch and display population data for the latest earthquake
-        latest_quake = quakes[0]
-        st.subheader(f"👥 Population Data near {latest_quake['Location']}")
+        # Display population data for each earthquake
+        st.subheader("👥 Population Data near Recent Earthquakes")
         
-        # Assuming longitude and latitude are available in latest_quake
-        population_data = get_population_data_from_statsnz(
-            latest_quake['longitude'], 
-            latest_quake['latitude']
-        )
+        population_data = get_population_data_from_statsnz(population_request, quakes)
         
         if population_data:
-            # For now, just display the raw data.
-            # Later, this can be processed into a GeoDataFrame and visualized.
-            st.json(population_data) 
+            for entry in population_data:
+                with st.expander(entry['Location']):
+                    if entry['Population']:
+                        # For now, just display the raw data.
+                        # Later, this can be processed into a GeoDataFrame and visualized.
+                        st.json(entry['Population'])
+                    else:
+                        st.info("No population data found for this location.")
         else:
-            st.info("No population data found or API key missing for this location.")
+            st.info("No population data found or API key missing for these locations.")
         
-        with open("llm_prompt.txt", "r", encoding="utf-8") as f:
-            prompt_template = f.read()
+        prompt_template = load_prompt_template()
         
-        prompt = prompt_template.replace("{{earthquake_data}}", json.dumps(quakes, indent=2, ensure_ascii=False)) \
-                            .replace("{{population_data}}", json.dumps(population_data, indent=2, ensure_ascii=False))
+        prompt = prompt_template.replace("{{earthquake_data}}", format_quakes_for_prompt(quakes)) \
+                            .replace("{{population_data}}", format_population_for_prompt(population_data))
             
-        llm_response = call_llm_api(prompt)
-        
         st.subheader("🤖 LLM Report")
+
+        # Show the raw report text as it streams in, then replace it with the formatted report.
+        with st.status("Generating report...", expanded=True) as status:
+            stream_placeholder = st.empty()
+            llm_response = generate_report(prompt, quakes, population_data, user_persona, on_token=lambda text: stream_placeholder.code(text, language="json"))
+            stream_placeholder.empty()
+            if 'error' in llm_response:
+                status.update(label="Report generation failed", state="error", expanded=False)
+            else:
+                status.update(label="Report generated", state="complete", expanded=False)
         
         if 'error' in llm_response:
             st.error(llm_response['error'])
@@ -1,138 +0,0 @@
-import requests
-import json
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
-import os
-import time
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Define the path for the notification status file
-NOTIFICATION_FILE = "notification_status.txt"
-MAGNITUDE_THRESHOLD = 4.0
-
-def get_latest_earthquakes_background():
-    """
-    A background function that retrieves the latest earthquake data from the GeoNet API.
-    This function does not use Streamlit's cache and simply retrieves data.
-    """
-    api_url = "https://api.geonet.org.nz/quake?MMI=3"
-    
-    try:
-        response = requests.get(api_url)
-        response.raise_for_status()
-        
-        earthquake_data = response.json()
-        formatted_data = []
-        
-        for feature in earthquake_data['features'][:5]: # Limit to top 5 for efficiency
-            props = feature['properties']
-            
-            time_utc = datetime.fromisoformat(props['time'].replace('Z', '+00:00'))
-            
-            formatted_data.append({
-                "ID": props['publicID'],
-                "Location": props['locality'],
-                "Magnitude": props['magnitude'],
-                "Depth (km)": props['depth'],
-                "Shaking Intensity (MMI)": props['mmi'],
-                "Time (NZST)": time_utc.strftime('%Y-%m-%d %H:%M:%S'),
-                "latitude": feature['geometry']['coordinates'][1],
-                "longitude": feature['geometry']['coordinates'][0]
-            })
-            
-        return formatted_data
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Error accessing the GeoNet API in background: {e}")
-        return None
-
-def send_discord_notification(message):
-    """
-    Sends a notification message to a Discord webhook.
-    """
-    webhook_url = os.getenv("DISCORD_WEBHOOK_URL")
-    if not webhook_url:
-        print("DISCORD_WEBHOOK_URL not found in .env file. Skipping Discord notification.")
-        return
-
-    payload = {
-        "content": message
-    }
-    
-    try:
-        response = requests.post(webhook_url, json=payload)
-        response.raise_for_status()
-        print("Successfully sent notification to Discord.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending notification to Discord: {e}")
-
-def check_for_major_quakes():
-    """
-    A function that checks for major earthquakes and writes them to a notification file.
-    """
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking for major earthquakes...")
-    quakes = get_latest_earthquakes_background()
-    
-    if quakes:
-        major_quake_detected = False
-        notification_messages = []
-        for quake in quakes:
-            if quake['Magnitude'] is not None and quake['Magnitude'] >= MAGNITUDE_THRESHOLD:
-                major_quake_detected = True
-                message = (
-                           f"🚨 Major Earthquake Detected! "
-                           f"Magnitude: {quake['Magnitude']}, "
-                           f"Location: {quake['Location']}, "
-                           f"Time: {quake['Time (NZST)']}")
-                notification_messages.append(message)
-        
-        if major_quake_detected:
-            full_message = "\n".join(notification_messages)
-            with open(NOTIFICATION_FILE, "w", encoding="utf-8") as f:
-                f.write(full_message)
-            print(f"Major quake notification written to {NOTIFICATION_FILE}")
-            send_discord_notification(full_message) # Send notification to Discord
-        else:
-            # Clear the notification file if no major quakes are detected
-            if os.path.exists(NOTIFICATION_FILE):
-                os.remove(NOTIFICATION_FILE)
-                print(f"No major quakes, {NOTIFICATION_FILE} cleared.")
-    else:
-        print("No earthquake data received from GeoNet API.")
-        # Also clear the file if there's an API error
-        if os.path.exists(NOTIFICATION_FILE):
-            os.remove(NOTIFICATION_FILE)
-            print(f"API error, {NOTIFICATION_FILE} cleared.")
-
-def read_notification_status():
-    """
-    Reads the content of the notification status file.
-    Returns the content as a string, or None if the file does not exist.
-    """
-    if os.path.exists(NOTIFICATION_FILE):
-        with open(NOTIFICATION_FILE, "r", encoding="utf-8") as f:
-            return f.read()
-    return None
-
-if __name__ == "__main__":
-    # Ensure the notification file exists and is empty on startup
-    if os.path.exists(NOTIFICATION_FILE):
-        os.remove(NOTIFICATION_FILE)
-    
-    scheduler = BackgroundScheduler()
-    # Schedule check_for_major_quakes to run every 30 seconds
-    scheduler.add_job(check_for_major_quakes, 'interval', seconds=30)
-    
-    print("Starting notification scheduler. Press Ctrl+C to exit.")
-    scheduler.start()
-
-    try:
-        # This is to keep the main thread alive so that the scheduler can run
-        while True:
-            time.sleep(2)
-    except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
-        print("Scheduler shut down.")